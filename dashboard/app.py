@@ -1,53 +1,136 @@
+import io
+import weakref
+
+import numpy as np
 import streamlit as st
 import pandas as pd
 
+FILTER_COLUMNS = ("compliance", "accountId", "controlName", "resourceType")
+PAGE_SIZE = 1000
+# the loaded DataFrames are shared by every session, so bound how many are kept
+LOADED_FRAMES = 4
+LOADED_FRAME_TTL = "1h"
+
 
-def multiselect_filter(df, column, label, key, col):
-    """Create a multiselect filter for a specific column in the DataFrame.
-    If the column exists, it will create a multiselect widget with options from the column.
-    If 'All' is selected, it will not filter the DataFrame.
-    If specific values are selected, it will filter the DataFrame accordingly.
+@st.cache_resource(show_spinner=False, max_entries=LOADED_FRAMES, ttl=LOADED_FRAME_TTL)
+def load_frame(file_bytes):
+    """Parse the uploaded CSV into a DataFrame.
+    Every column is read as a string, which keeps the leading zeros of account IDs.
+    The filter columns are stored as categoricals so filtering compares integer codes.
+    The cache is keyed on the raw bytes of the upload, so reruns triggered by widget
+    interactions skip the parse and a new upload invalidates it. The DataFrame is
+    cached as a shared resource so every rerun gets the same object, which lets
+    per-DataFrame values be memoized on it. It must not be mutated. Only the most
+    recent uploads are kept, and each for at most LOADED_FRAME_TTL.
     """
-    if column in df.columns:
-        options = ["All"] + sorted(df[column].dropna().unique().tolist())
-        if key not in st.session_state:
-            st.session_state[key] = ["All"]
-        col.multiselect(
-            label,
-            options=options,
-            key=key,
-            on_change=remove_all_from_multiselect,
-            args=(key,),
-        )
-        selected = st.session_state.get(key, ["All"])
-        if "All" not in selected:
-            df = df[df[column].isin(selected)]
+    df = pd.read_csv(io.BytesIO(file_bytes), dtype=str)
+    for column in FILTER_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
     return df
 
 
+def filter_options(df):
+    """Return the multiselect options for every filter column present in the DataFrame:
+    'All' followed by the column's sorted unique values.
+    The filter columns are categoricals, so the unique values are read from their
+    categories instead of scanning the rows. The options are memoized in the session
+    state per DataFrame, so only the first rerun after a new upload computes them.
+    The memo holds a weak reference to its DataFrame, so it neither keeps an evicted
+    DataFrame alive nor matches a new one that reuses its id.
+    """
+    cache_key = "_filter_options"
+    cached = st.session_state.get(cache_key)
+    if cached is None or cached[0]() is not df:
+        options = {
+            column: ["All"] + sorted(df[column].cat.categories.tolist())
+            for column in FILTER_COLUMNS
+            if column in df.columns
+        }
+        st.session_state[cache_key] = (weakref.ref(df), options)
+        return options
+    return cached[1]
+
+
+def multiselect_filter(options, column, label, key, col):
+    """Create a multiselect filter for a specific column of the DataFrame.
+    If the column has options, it will create a multiselect widget with them.
+    Returns the selected values, or None if the column is missing or 'All' is selected,
+    so the caller can combine every active filter into a single mask.
+    """
+    if column not in options:
+        return None
+    if key not in st.session_state:
+        st.session_state[key] = ["All"]
+    col.multiselect(
+        label,
+        options=options[column],
+        key=key,
+        on_change=remove_all_from_multiselect,
+        args=(key,),
+    )
+    selected = st.session_state.get(key, ["All"])
+    if "All" in selected:
+        return None
+    return selected
+
+
 def remove_all_from_multiselect(key):
     """Remove 'All' from the selected values if other values are also selected.
     If no values are selected, reset to 'All'.
     """
     selected = st.session_state.get(key, [])
-    if selected == []:
+    if not selected:
         st.session_state[key] = ["All"]
-    elif "All" in selected and len(selected) > 1:
+    elif len(selected) == 1:
+        return
+    elif selected[0] == "All":
+        # the common case: a value was picked while the default 'All' was selected
+        st.session_state[key] = selected[1:]
+    elif "All" in selected:
         st.session_state[key] = [v for v in selected if v != "All"]
 
 
 def display_filters(df):
     """Display multiselect filters for the DataFrame.
-    Creates two rows of columns for filters and applies the filters to the DataFrame.
+    Creates two rows of columns for filters, then applies all active filters to the
+    DataFrame with a single combined mask so only one filtered copy is materialized.
     """
+    options = filter_options(df)
     with st.expander("Filters"):
         filter_row1 = st.columns(2)
         filter_row2 = st.columns(2)
-        df = multiselect_filter(df, "compliance", "Compliance Status", "compliance_status_filter", filter_row1[0])
-        df = multiselect_filter(df, "accountId", "Account ID", "account_id_filter", filter_row1[1])
-        df = multiselect_filter(df, "controlName", "Control Name", "control_name_filter", filter_row2[0])
-        df = multiselect_filter(df, "resourceType", "Resource Type", "resource_type_filter", filter_row2[1])
-    return df
+        filters = [
+            ("compliance", multiselect_filter(options, "compliance", "Compliance Status", "compliance_status_filter", filter_row1[0])),
+            ("accountId", multiselect_filter(options, "accountId", "Account ID", "account_id_filter", filter_row1[1])),
+            ("controlName", multiselect_filter(options, "controlName", "Control Name", "control_name_filter", filter_row2[0])),
+            ("resourceType", multiselect_filter(options, "resourceType", "Resource Type", "resource_type_filter", filter_row2[1])),
+        ]
+    active = [(column, selected) for column, selected in filters if selected is not None]
+    if not active:
+        return df
+    mask = np.ones(len(df), dtype=bool)
+    for column, selected in active:
+        codes = df[column].cat.categories.get_indexer(selected)
+        mask &= np.isin(df[column].cat.codes.to_numpy(), codes[codes >= 0])
+    return df.loc[mask]
+
+
+def display_page(df, key="results_page"):
+    """Display one page of the DataFrame.
+    Only the rows of the selected page are serialized and sent to the browser,
+    so the payload per rerun is bounded by PAGE_SIZE instead of the filtered row count.
+    """
+    page_count = max(1, -(-len(df) // PAGE_SIZE))
+    if st.session_state.get(key, 1) > page_count:
+        st.session_state[key] = page_count
+    # no default value: the widget is driven by its session state key, which is
+    # clamped above, and otherwise starts at min_value
+    page = st.number_input("Page", min_value=1, max_value=page_count, step=1, key=key)
+    start = (page - 1) * PAGE_SIZE
+    end = min(start + PAGE_SIZE, len(df))
+    st.caption(f"Showing rows {start + 1 if end else 0}-{end} of {len(df)}")
+    st.dataframe(df.iloc[start:end], use_container_width=True)
 
 
 def main():
@@ -56,9 +139,9 @@ def main():
     file_content = st.file_uploader("Upload a CSV file", type=["csv"])
 
     if file_content is not None:
-        df = pd.read_csv(file_content)
+        df = load_frame(file_content.getvalue())
         filtered_df = display_filters(df)
-        st.dataframe(filtered_df, use_container_width=True)
+        display_page(filtered_df)
 
 
 if __name__ == "__main__":
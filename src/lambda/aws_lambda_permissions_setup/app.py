@@ -3,50 +3,86 @@
 # be able to access the config rules
 # Eventbridge rule run every 6 hours
 import os
+import functools
 import json
 import logging
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 import botocore
+from botocore.config import Config
 import urllib3
 
 
 SUCCESS = "SUCCESS"
 FAILED = "FAILED"
 
-# cfnresponse replacement
-http = urllib3.PoolManager()
+# cfnresponse replacement - module level so warm invocations reuse the connection
+http = urllib3.PoolManager(
+    num_pools=1,
+    maxsize=4,
+    retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]),
+)
+
+# let the SDK back off adaptively when Organizations throttles the account listing
+ORGANIZATIONS_CLIENT_CONFIG = Config(retries={"max_attempts": 10, "mode": "adaptive"})
+
+# functions are processed concurrently (each function's add_permission calls
+# stay serial), so the Lambda client needs a connection pool large enough for
+# the workers and SDK-side throttling retries
+MAX_WORKERS = 16
+# AddPermission reports a concurrent write to the same function policy as
+# ResourceConflictException; retry it a bounded number of times. The same code
+# is returned when the Sid already exists, which is not retried
+MAX_CONFLICT_RETRIES = 5
+LAMBDA_CLIENT_CONFIG = Config(max_pool_connections=32, retries={"max_attempts": 10, "mode": "adaptive"})
+
+CLIENT_CONFIGS = {
+    "organizations": ORGANIZATIONS_CLIENT_CONFIG,
+    "lambda": LAMBDA_CLIENT_CONFIG,
+}
 
 # Logging setup
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+@functools.lru_cache(maxsize=None)
+def get_client(service):
+    """Returns a boto3 client for the service, created once per Lambda container
+    so warm invocations don't reload the service model.
+    :param service: the AWS service name
+    :return: boto3 client
+    """
+    return boto3.client(service, config=CLIENT_CONFIGS.get(service))
+
+
 def get_accounts():
-    """Queries AWS Organizations and returns a List of AWS Accounts
-    :return: List of AWS Accounts
+    """Queries AWS Organizations and returns a List of the ACTIVE AWS Accounts
+    :return: List of ACTIVE AWS Accounts
     """
     accounts = []
-    client = boto3.client("organizations")
+    client = get_client("organizations")
+    paginator = client.get_paginator("list_accounts")
     b_retry = True
     b_completed = False
     while b_retry and (not b_completed):
         try:
-            response = client.list_accounts()
-            if response:
-                accounts = response.get("Accounts")
-                next_token = response.get("NextToken")
-                while next_token:
-                    response = client.list_accounts(NextToken=next_token)
-                    accounts.extend(response.get("Accounts"))
-                    next_token = response.get("NextToken")
-            else:
+            accounts = [
+                account
+                for page in paginator.paginate(PaginationConfig={"PageSize": 20})
+                for account in page.get("Accounts", [])
+                # suspended/closed accounts can't be granted permissions, drop them here
+                if account.get("Status") == "ACTIVE"
+            ]
+            if not accounts:
                 logger.error("Unable to read account data from AWS - empty response.")
-                b_retry = False
             b_completed = True
         except botocore.exceptions.ClientError as error:
             if error.response["Error"]["Code"] == "TooManyRequestsException":
+                # the SDK already retried with adaptive backoff; restart the listing
                 logger.warning("API call limit exceeded; backing off and retrying...")
                 time.sleep(0.25)
                 b_retry = True
@@ -60,6 +96,99 @@ def get_accounts():
     return accounts
 
 
+def add_lambda_permission(client, lambda_name, account_id, statement_id):
+    """Grants an AWS Account permission to invoke a Lambda Function, backing off when throttled
+    or when the function's policy is being updated.
+    :return: True if the permission was added, False otherwise
+    """
+    conflict_retries = 0
+    while True:
+        try:
+            # this is a regular account so we can add the config service permission
+            response = client.add_permission(
+                Action="lambda:InvokeFunction",
+                FunctionName=lambda_name,
+                Principal="*",
+                SourceAccount=account_id,
+                StatementId=statement_id,
+            )
+        except botocore.exceptions.ClientError as error:
+            # error while trying to add the permission
+            # are we being throttled?
+            if error.response["Error"]["Code"] == "TooManyRequestsException":
+                logger.warning("API call limit exceeded; backing off and retrying...")
+                time.sleep(0.25)
+                continue
+            if (error.response["Error"]["Code"] == "ResourceConflictException"
+                    and "already exists" not in error.response["Error"].get("Message", "")
+                    and conflict_retries < MAX_CONFLICT_RETRIES):
+                conflict_retries += 1
+                logger.warning("Policy update in progress for '%s'; backing off and retrying...", lambda_name)
+                time.sleep(0.25 * conflict_retries)
+                continue
+            logger.error("Error while adding permission for account '%s' to the '%s' lambda", account_id, lambda_name)
+            logger.error("Error: {%s}", error)
+            return False
+        if not response.get("Statement"):
+            # invalid response
+            logger.error("Invalid response adding permission for account '%s' to the '%s'", account_id, lambda_name)
+            return False
+        # success
+        logger.info("Successfully added permission for account '%s' to Lambda '%s' using function name '%s' (Principal: %s, SID: %s)",
+                    account_id, lambda_name, lambda_name, "*", statement_id)
+        return True
+
+
+def add_function_permissions(client, lambda_name, pending_permissions):
+    """Adds the pending permissions to one Lambda Function one at a time, since
+    concurrent writes to the same resource-based policy conflict.
+    :param pending_permissions: list of (account id, statement id) tuples
+    :return: list of add_lambda_permission results, in order
+    """
+    return [
+        add_lambda_permission(client, lambda_name, account_id, statement_id)
+        for account_id, statement_id in pending_permissions
+    ]
+
+
+def parse_lambda_policy(policy_json):
+    """Parses a Lambda Function resource-based policy once and extracts the accounts
+    already authorized to invoke it and the statement ids in use by any statement.
+    :param policy_json: the JSON policy document returned by get_policy
+    :return: tuple of (set of authorized account ids, set of Sids in use)
+    """
+    authorized_accounts = set()
+    sids_in_use = set()
+    for statement in json.loads(policy_json).get("Statement"):
+        # every statement's Sid is taken, whatever it grants
+        if statement.get("Sid", ""):
+            sids_in_use.add(statement.get("Sid", ""))
+
+        principal = statement.get("Principal", {})
+
+        # Handle different principal types
+        if isinstance(principal, dict):
+            service = principal.get("Service")
+        elif principal == "*":
+            service = "*"
+        else:
+            service = None
+
+        # Check for both config.amazonaws.com and wildcard permissions
+        if (
+            service in ["config.amazonaws.com", "*"]
+            and statement.get("Action") == "lambda:InvokeFunction"
+            and statement.get("Effect") == "Allow"
+        ):
+            # this is an authorized account
+            try:
+                source_account = (statement.get("Condition").get("StringEquals").get("AWS:SourceAccount"))
+                authorized_accounts.add(source_account)
+            except AttributeError:
+                source_account = ""
+    return authorized_accounts, sids_in_use
+
+
 def apply_lambda_permissions():
     """Ensures all GC Guardrail Assessment Lambda Functions can be invoked by all
     AWS Accounts in the Organization.
@@ -112,15 +241,20 @@ def apply_lambda_permissions():
         f"{organization_name}gc13_check_emergency_account_testing": ["GC13CheckEmergencyAccountTestingLambda"],
     }
     accounts = get_accounts()
-    client = boto3.client("lambda")
+    client = get_client("lambda")
     i_requests = 0
     accounts_processed = 0
     accounts_failed = 0
     if accounts:
+        # flatten the account records once so the per-function loops below
+        # don't repeat the dict lookups; get_accounts only returns ACTIVE accounts
+        account_ids = [account["Id"] for account in accounts]
+        function_permissions = []
         for lambda_name in lambda_functions:
-            # check if any accounts are currently authorized
-            authorized_accounts = []
-            sids_in_use = []
+            # check if any accounts are currently authorized - sets keep the
+            # per-account membership checks below O(1) as the policy grows
+            authorized_accounts = set()
+            sids_in_use = set()
             b_retry = True
             b_completed = False
             while b_retry and (not b_completed):
@@ -130,33 +264,7 @@ def apply_lambda_permissions():
                     if i_requests % 3 == 0:
                         # backing off the API to avoid throttling
                         time.sleep(0.05)
-                    for statement in json.loads(response.get("Policy")).get("Statement"):
-                        principal = statement.get("Principal", {})
-                        
-                        # Handle different principal types
-                        if isinstance(principal, dict):
-                            service = principal.get("Service")
-                        elif principal == "*":
-                            service = "*"
-                        else:
-                            service = None
-                        
-                        # Check for both config.amazonaws.com and wildcard permissions
-                        if (
-                            service in ["config.amazonaws.com", "*"]
-                            and statement.get("Action") == "lambda:InvokeFunction"
-                            and statement.get("Effect") == "Allow"
-                        ):
-                            # this is an authorized account
-                            try:
-                                source_account = (statement.get("Condition").get("StringEquals").get("AWS:SourceAccount"))
-                                authorized_accounts.append(source_account)
-                            except AttributeError:
-                                source_account = ""
-                            
-                            if statement.get("Sid", ""):
-                                sids_in_use.append(statement.get("Sid", ""))
-                            
+                    authorized_accounts, sids_in_use = parse_lambda_policy(response.get("Policy"))
                     b_completed = True
                     
 
@@ -180,82 +288,41 @@ def apply_lambda_permissions():
                     logger.error("Unknown Exception trying to get policy for Lambda function '%s'.", lambda_name)
                     b_retry = False
             
+            # anti-join the accounts against the authorized ones in one pass
+            pending_accounts = [account_id for account_id in account_ids if account_id not in authorized_accounts]
+            logger.debug("%d of %d accounts need permissions for '%s'",
+                         len(pending_accounts), len(account_ids), lambda_name)
+
             i = 0
-            b_throttle = False
-            for account in accounts:
-                account_id = account["Id"]
-                account_status = str(account["Status"]).upper()
-                accounts_processed += 1
-                
-                logger.debug("Processing account %d/%d: %s (Status: %s)", 
-                           accounts_processed, len(accounts), account_id, account_status)
-                
-                if (account_id in authorized_accounts) or (account_status != "ACTIVE"):
-                    # skip this account and go to the next loop iteration
-                    i += 1
-                    permissions_validated += 1
-                    logger.debug("Account %s already has permissions or is inactive - skipping", account_id)
-                    continue
-                # we need to add the permission
+            pending_permissions = []
+            for account_id in pending_accounts:
                 compliant_resource_name = str(i) #f"p{i + 1}"
                 # ensure we are using a unique Sid
                 while compliant_resource_name in sids_in_use:
                     i += 1
                     compliant_resource_name = str(i) #f"p{i + 1}"
-                b_retry = True
-                b_permission_added = False
-            
-                while b_retry and (not b_permission_added):
-                    # if we've been throttled, sleep 50ms every 5 calls
-                    if b_throttle and (i_requests % 5 == 0):
-                        time.sleep(0.05)
-                    try:
-                        i_requests += 1
-                        
-                        # this is a regular account so we can add the config service permission
-                        response = client.add_permission(
-                            Action="lambda:InvokeFunction",
-                            FunctionName=lambda_name,
-                            Principal="*",
-                            SourceAccount=account_id,
-                            StatementId=compliant_resource_name,
-                        )
-                        if not response.get("Statement"):
-                            # invalid response
-                            logger.error("Invalid response adding permission for account '%s' to the '%s'", account_id, lambda_name)
-                            # Don't set i_result = -1, just stop retrying for this account
-                            # Continue processing other accounts
-                            accounts_failed += 1
-                            b_retry = False
-                            break  # Break out of retry loop for this account, continue to next account
-                        else:
-                            # success
-                            permissions_validated += 1
-                            b_permission_added = True
-                            principal_type = "*"
-                            logger.info("Successfully added permission for account '%s' to Lambda '%s' using function name '%s' (Principal: %s, SID: %s)", 
-                                      account_id, lambda_name, lambda_name, principal_type, compliant_resource_name)
-                            if compliant_resource_name not in sids_in_use:
-                                # add the Sid to the list of used Sids
-                                sids_in_use.append(compliant_resource_name)
-                    except botocore.exceptions.ClientError as error:
-                        # error while trying to add the permission
-                        # are we being throttled?
-                        if (error.response["Error"]["Code"] == "TooManyRequestsException"):
-                            logger.warning("API call limit exceeded; backing off and retrying...")
-                            b_throttle = True
-                            b_retry = True
-                            time.sleep(0.25)
-                        else:
-                            logger.error("Error while adding permission for account '%s' to the '%s' lambda", account_id, lambda_name)
-                            logger.error("Error: {%s}", error)
-                            # Don't set i_result = -1 here, just stop retrying for this account
-                            # We'll continue processing other accounts
-                            accounts_failed += 1
-                            b_retry = False
+                pending_permissions.append((account_id, compliant_resource_name))
                 i += 1
-                # Remove the early break - continue processing all accounts
-                # We'll determine final result after processing all accounts
+            function_permissions.append((lambda_name, authorized_accounts, pending_permissions))
+
+        # the add_permission calls are IO bound, so the functions are processed
+        # concurrently; each worker adds its function's accounts serially
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            function_results = list(executor.map(
+                lambda function: add_function_permissions(client, function[0], function[2]),
+                function_permissions,
+            ))
+
+        for (lambda_name, authorized_accounts, pending_permissions), results in zip(function_permissions, function_results):
+            accounts_processed += len(account_ids)
+            permissions_validated += len(account_ids) - len(pending_permissions)
+            for b_permission_added in results:
+                if b_permission_added:
+                    permissions_validated += 1
+                else:
+                    # Don't set i_result = -1, just count the failure
+                    # and continue processing other accounts
+                    accounts_failed += 1
             
             # Determine final result based on what we accomplished
             logger.info("Account processing summary for Lambda '%s':", lambda_name)
@@ -0,0 +1,22 @@
+"""
+Shared pytest fixtures for the aws_lambda_permissions_setup tests.
+"""
+
+import boto3
+import pytest
+
+
+@pytest.fixture(scope="session")
+def boto_session():
+    """Session-scoped boto3 session so service models are loaded once per test run."""
+    return boto3.session.Session(
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+        region_name="us-east-1",
+    )
+
+
+@pytest.fixture(scope="session")
+def lambda_client(boto_session):
+    """Session-scoped Lambda client shared by the stubbed apply_lambda_permissions tests."""
+    return boto_session.client("lambda")
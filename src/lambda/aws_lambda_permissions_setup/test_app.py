@@ -5,20 +5,55 @@ Tests cover account retrieval, permission management, CloudFormation responses,
 
 import json
 import os
+import threading
+import time
+from types import SimpleNamespace
 import pytest
 from unittest import mock
 from unittest.mock import Mock, patch, MagicMock
 from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+from moto import mock_aws
 import urllib3
 
 import app
 
+# Number of GC Guardrail Assessment Lambda Functions handled by apply_lambda_permissions
+LAMBDA_FUNCTION_COUNT = 40
+
+# Policy granting the first sample account permission to invoke the functions
+EXISTING_POLICY = {
+    "Statement": [
+        {
+            "Effect": "Allow",
+            "Principal": {"Service": "config.amazonaws.com"},
+            "Action": "lambda:InvokeFunction",
+            "Condition": {
+                "StringEquals": {"AWS:SourceAccount": "123456789012"}
+            },
+            "Sid": "ExistingSid",
+        }
+    ]
+}
+
 
 @pytest.fixture(autouse=True)
 def set_env(monkeypatch):
     """Set up environment variables for all tests."""
     monkeypatch.setenv("OrganizationName", "testorg-")
     monkeypatch.setenv("ORG_ID", "o-1234567890")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.delenv("AWS_PROFILE", raising=False)
+
+
+@pytest.fixture(autouse=True)
+def clear_client_cache():
+    """Clear the cached boto3 clients so each test's patching takes effect."""
+    app.get_client.cache_clear()
+    yield
+    app.get_client.cache_clear()
 
 
 @pytest.fixture
@@ -31,6 +66,12 @@ def sample_accounts():
     ]
 
 
+@pytest.fixture
+def active_accounts(sample_accounts):
+    """Sample accounts as returned by get_accounts, which drops inactive accounts."""
+    return [account for account in sample_accounts if account["Status"] == "ACTIVE"]
+
+
 @pytest.fixture
 def sample_lambda_event():
     """Sample CloudFormation event for testing."""
@@ -47,159 +88,196 @@ def sample_lambda_event():
 @pytest.fixture
 def mock_context():
     """Mock Lambda context object."""
-    context = Mock()
-    context.log_stream_name = "test-log-stream"
-    return context
+    return SimpleNamespace(log_stream_name="test-log-stream")
+
+
+@pytest.fixture
+def org_client(boto_session):
+    """Organizations client backed by moto, with an organization and two member accounts."""
+    with mock_aws():
+        client = boto_session.client("organizations")
+        client.create_organization(FeatureSet="ALL")
+        client.create_account(Email="account1@example.com", AccountName="Account1")
+        client.create_account(Email="account2@example.com", AccountName="Account2")
+        yield client
+
+
+@pytest.fixture
+def org_stubber(boto_session):
+    """Stubber on a real Organizations client returned by boto3.client."""
+    client = boto_session.client("organizations")
+    with Stubber(client) as stubber, patch("boto3.client", return_value=client):
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+@pytest.fixture
+def lambda_stubber(lambda_client):
+    """Stubber on the shared Lambda client, which boto3.client returns."""
+    with Stubber(lambda_client) as stubber, patch("boto3.client", return_value=lambda_client):
+        yield stubber
+        stubber.assert_no_pending_responses()
 
 
 class TestGetAccounts:
     """Test cases for get_accounts function."""
 
-    @patch("boto3.client")
-    def test_get_accounts_success(self, mock_boto_client, sample_accounts):
+    def test_get_accounts_success(self, org_client):
         """Test successful account retrieval."""
-        mock_org_client = Mock()
-        mock_org_client.list_accounts.return_value = {
-            "Accounts": sample_accounts,
-            "NextToken": None,
-        }
-        mock_boto_client.return_value = mock_org_client
-
         result = app.get_accounts()
 
-        assert result == sample_accounts
-        mock_boto_client.assert_called_with("organizations")
-        mock_org_client.list_accounts.assert_called_once()
+        assert sorted(account["Name"] for account in result) == ["Account1", "Account2", "master"]
+        assert all(account["Status"] == "ACTIVE" for account in result)
 
-    @patch("boto3.client")
-    def test_get_accounts_with_pagination(self, mock_boto_client, sample_accounts):
+    def test_get_accounts_with_pagination(self, org_stubber, sample_accounts):
         """Test account retrieval with pagination."""
-        mock_org_client = Mock()
-        # First call returns partial results with NextToken
-        mock_org_client.list_accounts.side_effect = [
+        org_stubber.add_response(
+            "list_accounts",
             {"Accounts": sample_accounts[:2], "NextToken": "token123"},
-            {"Accounts": sample_accounts[2:], "NextToken": None},
-        ]
-        mock_boto_client.return_value = mock_org_client
+            {"MaxResults": 20},
+        )
+        org_stubber.add_response(
+            "list_accounts",
+            {"Accounts": sample_accounts[2:]},
+            {"MaxResults": 20, "NextToken": "token123"},
+        )
 
         result = app.get_accounts()
 
-        assert len(result) == 3
-        assert result == sample_accounts
-        assert mock_org_client.list_accounts.call_count == 2
+        # the SUSPENDED account on the second page is dropped
+        assert len(result) == 2
+        assert result == sample_accounts[:2]
 
-    @patch("boto3.client")
-    def test_get_accounts_too_many_requests(self, mock_boto_client):
+    def test_get_accounts_too_many_requests(self, org_stubber):
         """Test account retrieval with throttling."""
-        mock_org_client = Mock()
-        # First call raises TooManyRequestsException, second succeeds
-        mock_org_client.list_accounts.side_effect = [
-            ClientError(
-                {
-                    "Error": {
-                        "Code": "TooManyRequestsException",
-                        "Message": "Rate exceeded",
-                    }
-                },
-                "ListAccounts",
-            ),
-            {"Accounts": [], "NextToken": None},
-        ]
-        mock_boto_client.return_value = mock_org_client
+        org_stubber.add_client_error(
+            "list_accounts", "TooManyRequestsException", "Rate exceeded"
+        )
+        org_stubber.add_response("list_accounts", {"Accounts": []})
 
         with patch("time.sleep"):
             result = app.get_accounts()
 
         assert result == []
-        assert mock_org_client.list_accounts.call_count == 2
 
-    @patch("boto3.client")
-    def test_get_accounts_access_denied(self, mock_boto_client):
+    def test_get_accounts_access_denied(self, org_stubber):
         """Test account retrieval with access denied error."""
-        mock_org_client = Mock()
-        mock_org_client.list_accounts.side_effect = ClientError(
-            {"Error": {"Code": "AccessDeniedException", "Message": "Access denied"}},
-            "ListAccounts",
+        org_stubber.add_client_error(
+            "list_accounts", "AccessDeniedException", "Access denied"
         )
-        mock_boto_client.return_value = mock_org_client
 
         result = app.get_accounts()
 
         assert result == []
 
-    @patch("boto3.client")
-    def test_get_accounts_empty_response(self, mock_boto_client):
+    def test_get_accounts_empty_response(self, org_stubber):
         """Test account retrieval with empty response."""
-        mock_org_client = Mock()
-        mock_org_client.list_accounts.return_value = None
-        mock_boto_client.return_value = mock_org_client
+        org_stubber.add_response("list_accounts", {})
 
         result = app.get_accounts()
 
         assert result == []
 
 
-class TestApplyLambdaPermissions:
-    """Test cases for apply_lambda_permissions function."""
+class TestParseLambdaPolicy:
+    """Test cases for parse_lambda_policy function."""
 
-    @patch("app.get_accounts")
-    @patch("boto3.client")
-    def test_apply_lambda_permissions_success(
-        self, mock_boto_client, mock_get_accounts, sample_accounts
-    ):
-        """Test successful permission application."""
-        # Mock accounts
-        mock_get_accounts.return_value = sample_accounts
+    def test_parse_lambda_policy_authorized_account(self):
+        """Test the authorized accounts and Sids are extracted from the policy."""
+        authorized_accounts, sids_in_use = app.parse_lambda_policy(json.dumps(EXISTING_POLICY))
 
-        # Mock Lambda client
-        mock_lambda_client = Mock()
-        mock_lambda_client.get_policy.side_effect = ClientError(
-            {"Error": {"Code": "ResourceNotFoundException"}}, "GetPolicy"
-        )
-        mock_lambda_client.add_permission.return_value = {"Statement": "test-statement"}
-        mock_boto_client.return_value = mock_lambda_client
+        assert authorized_accounts == {"123456789012"}
+        assert sids_in_use == {"ExistingSid"}
 
-        result = app.apply_lambda_permissions()
-
-        assert result == 1
-        # Should be called for each lambda function
-        assert mock_lambda_client.add_permission.call_count > 0
-
-    @patch("app.get_accounts")
-    @patch("boto3.client")
-    def test_apply_lambda_permissions_with_existing_policy(
-        self, mock_boto_client, mock_get_accounts, sample_accounts
-    ):
-        """Test permission application with existing policy."""
-        mock_get_accounts.return_value = sample_accounts
-
-        # Mock existing policy
-        existing_policy = {
+    def test_parse_lambda_policy_ignores_other_actions(self):
+        """Test statements for other actions do not authorize accounts but keep their Sid."""
+        policy = {
             "Statement": [
                 {
                     "Effect": "Allow",
-                    "Principal": {"Service": "config.amazonaws.com"},
-                    "Action": "lambda:InvokeFunction",
+                    "Principal": "*",
+                    "Action": "lambda:GetFunction",
                     "Condition": {
-                        "StringEquals": {"AWS:SourceAccount": "123456789012"}
+                        "StringEquals": {"AWS:SourceAccount": "123456789013"}
                     },
-                    "Sid": "ExistingSid",
+                    "Sid": "OtherSid",
                 }
             ]
         }
 
-        mock_lambda_client = Mock()
-        mock_lambda_client.get_policy.return_value = {
-            "Policy": json.dumps(existing_policy)
-        }
-        mock_lambda_client.add_permission.return_value = {"Statement": "test-statement"}
-        mock_boto_client.return_value = mock_lambda_client
+        authorized_accounts, sids_in_use = app.parse_lambda_policy(json.dumps(policy))
+
+        assert authorized_accounts == set()
+        assert sids_in_use == {"OtherSid"}
+
+
+class TestAddLambdaPermission:
+    """Test cases for add_lambda_permission function."""
+
+    def test_add_lambda_permission_existing_sid_not_retried(self):
+        """Test a conflict on a Sid that already exists fails without retrying."""
+        client = Mock()
+        client.add_permission.side_effect = ClientError(
+            {
+                "Error": {
+                    "Code": "ResourceConflictException",
+                    "Message": "The statement id (0) provided already exists.",
+                }
+            },
+            "AddPermission",
+        )
+
+        with patch("time.sleep") as mock_sleep:
+            result = app.add_lambda_permission(client, "testorg-function", "123456789012", "0")
+
+        assert result is False
+        assert client.add_permission.call_count == 1
+        mock_sleep.assert_not_called()
+
+
+class TestApplyLambdaPermissions:
+    """Test cases for apply_lambda_permissions function."""
+
+    @pytest.mark.parametrize(
+        "policy, add_permission_result, expected",
+        [
+            (None, {"Statement": "test-statement"}, 1),
+            (EXISTING_POLICY, {"Statement": "test-statement"}, 1),
+            (None, "AccessDeniedException", -1),
+            (None, {}, -1),
+        ],
+        ids=["success", "with_existing_policy", "add_permission_error", "invalid_response"],
+    )
+    @patch("app.get_accounts")
+    def test_apply_lambda_permissions(
+        self, mock_get_accounts, active_accounts, lambda_stubber, policy, add_permission_result, expected
+    ):
+        """Test permission application against get_policy/add_permission outcomes."""
+        mock_get_accounts.return_value = active_accounts
+        authorized = set()
+        if policy is not None:
+            authorized = {
+                statement["Condition"]["StringEquals"]["AWS:SourceAccount"]
+                for statement in policy["Statement"]
+            }
+        pending = [account for account in active_accounts if account["Id"] not in authorized]
+
+        # every policy is read before the functions' permissions are added
+        for _ in range(LAMBDA_FUNCTION_COUNT):
+            if policy is None:
+                lambda_stubber.add_client_error("get_policy", "ResourceNotFoundException")
+            else:
+                lambda_stubber.add_response("get_policy", {"Policy": json.dumps(policy)})
+        for _ in range(LAMBDA_FUNCTION_COUNT):
+            for _ in pending:
+                if isinstance(add_permission_result, str):
+                    lambda_stubber.add_client_error("add_permission", add_permission_result)
+                else:
+                    lambda_stubber.add_response("add_permission", add_permission_result)
 
         result = app.apply_lambda_permissions()
 
-        assert result == 1
-        # Should still add permissions for accounts not in existing policy
-        assert mock_lambda_client.add_permission.call_count > 0
+        assert result == expected
 
     @patch("app.get_accounts")
     @patch("boto3.client")
@@ -213,85 +291,84 @@ class TestApplyLambdaPermissions:
 
         assert result == 0
 
+    @pytest.mark.parametrize(
+        "error_code", ["TooManyRequestsException", "ResourceConflictException"]
+    )
     @patch("app.get_accounts")
-    @patch("boto3.client")
-    def test_apply_lambda_permissions_add_permission_error(
-        self, mock_boto_client, mock_get_accounts, sample_accounts
+    def test_apply_lambda_permissions_throttling(
+        self, mock_get_accounts, sample_accounts, lambda_stubber, error_code
     ):
-        """Test permission application with add_permission error."""
-        mock_get_accounts.return_value = sample_accounts
+        """Test permission application retries throttling and policy update conflicts."""
+        mock_get_accounts.return_value = sample_accounts[
+            :1
+        ]  # Only one account to simplify
 
-        mock_lambda_client = Mock()
-        mock_lambda_client.get_policy.side_effect = ClientError(
-            {"Error": {"Code": "ResourceNotFoundException"}}, "GetPolicy"
-        )
-        mock_lambda_client.add_permission.side_effect = ClientError(
-            {"Error": {"Code": "AccessDeniedException", "Message": "Access denied"}},
-            "AddPermission",
-        )
-        mock_boto_client.return_value = mock_lambda_client
+        # fail the first add_permission call once, then succeed for every function
+        for _ in range(LAMBDA_FUNCTION_COUNT):
+            lambda_stubber.add_client_error("get_policy", "ResourceNotFoundException")
+        for function_index in range(LAMBDA_FUNCTION_COUNT):
+            if function_index == 0:
+                lambda_stubber.add_client_error("add_permission", error_code)
+            lambda_stubber.add_response("add_permission", {"Statement": "test-statement"})
 
-        result = app.apply_lambda_permissions()
+        with patch("time.sleep"):
+            result = app.apply_lambda_permissions()
 
-        assert result == -1
+        assert result == 1
 
     @patch("app.get_accounts")
     @patch("boto3.client")
-    def test_apply_lambda_permissions_invalid_response(
-        self, mock_boto_client, mock_get_accounts, sample_accounts
+    def test_apply_lambda_permissions_concurrent_unique_sids(
+        self, mock_boto_client, mock_get_accounts
     ):
-        """Test permission application with invalid response."""
-        mock_get_accounts.return_value = sample_accounts
+        """Test functions are processed concurrently while each function's calls stay
+        serial, with one call per account and unique Sids."""
+        accounts = [
+            {"Id": f"{100000000000 + i}", "Status": "ACTIVE", "Name": f"Account{i}"}
+            for i in range(50)
+        ]
+        mock_get_accounts.return_value = accounts
 
         mock_lambda_client = Mock()
         mock_lambda_client.get_policy.side_effect = ClientError(
             {"Error": {"Code": "ResourceNotFoundException"}}, "GetPolicy"
         )
-        mock_lambda_client.add_permission.return_value = {}  # No 'Statement' key
+        in_flight = {}
+        max_in_flight = {}
+        max_functions_in_flight = 0
+        lock = threading.Lock()
+
+        def add_permission(**kwargs):
+            nonlocal max_functions_in_flight
+            function_name = kwargs["FunctionName"]
+            with lock:
+                in_flight[function_name] = in_flight.get(function_name, 0) + 1
+                max_in_flight[function_name] = max(max_in_flight.get(function_name, 0), in_flight[function_name])
+                max_functions_in_flight = max(
+                    max_functions_in_flight, sum(1 for count in in_flight.values() if count)
+                )
+            time.sleep(0.001)
+            with lock:
+                in_flight[function_name] -= 1
+            return {"Statement": "test-statement"}
+
+        mock_lambda_client.add_permission.side_effect = add_permission
         mock_boto_client.return_value = mock_lambda_client
 
         result = app.apply_lambda_permissions()
 
-        assert result == -1
-
-    @patch("app.get_accounts")
-    @patch("boto3.client")
-    def test_apply_lambda_permissions_throttling(
-        self, mock_boto_client, mock_get_accounts, sample_accounts
-    ):
-        """Test permission application with throttling."""
-        mock_get_accounts.return_value = sample_accounts[
-            :1
-        ]  # Only one account to simplify
-
-        mock_lambda_client = Mock()
-        mock_lambda_client.get_policy.side_effect = ClientError(
-            {"Error": {"Code": "ResourceNotFoundException"}}, "GetPolicy"
-        )
-
-        # Create a cycle of responses: throttle once, then succeed for all subsequent calls
-        throttle_error = ClientError(
-            {"Error": {"Code": "TooManyRequestsException"}}, "AddPermission"
-        )
-        success_response = {"Statement": "test-statement"}
-
-        def add_permission_side_effect(*args, **kwargs):
-            # First call raises throttle error, all subsequent calls succeed
-            if not hasattr(add_permission_side_effect, "call_count"):
-                add_permission_side_effect.call_count = 0
-            add_permission_side_effect.call_count += 1
-
-            if add_permission_side_effect.call_count == 1:
-                raise throttle_error
-            return success_response
-
-        mock_lambda_client.add_permission.side_effect = add_permission_side_effect
-        mock_boto_client.return_value = mock_lambda_client
-
-        with patch("time.sleep"):
-            result = app.apply_lambda_permissions()
-
         assert result == 1
+        calls = mock_lambda_client.add_permission.call_args_list
+        function_names = {call.kwargs["FunctionName"] for call in calls}
+        assert len(calls) == len(accounts) * len(function_names)
+        for function_name in function_names:
+            function_calls = [call.kwargs for call in calls if call.kwargs["FunctionName"] == function_name]
+            assert len({call["StatementId"] for call in function_calls}) == len(accounts)
+            assert {call["SourceAccount"] for call in function_calls} == {a["Id"] for a in accounts}
+        # never more than one policy write in flight for the same function,
+        # while several functions are written at once
+        assert set(max_in_flight.values()) == {1}
+        assert max_functions_in_flight > 1
 
 
 class TestSendFunction:
@@ -1,13 +1,19 @@
 import csv
+import gzip
+import io
 import json
 import logging
+import operator
 import os
-from datetime import datetime
-from io import StringIO
+import re
+from collections import defaultdict
+from datetime import datetime, timezone
+from itertools import chain
+from urllib.parse import unquote_plus
 import urllib3
 
 import boto3
-from botocore.exceptions import BotoCoreError, ClientError
+from botocore.config import Config
 
 def get_required_env_var(name: str) -> str:
     value = os.environ.get(name)
@@ -15,211 +21,570 @@ def get_required_env_var(name: str) -> str:
         raise EnvironmentError(f"Required environment variable {name} is missing or empty.")
     return value
 
-config = {
-    "S3_BUCKET": get_required_env_var("S3_BUCKET"),
-    "MAX_RETRIES": 3,
-}
+S3_BUCKET = get_required_env_var("S3_BUCKET")
+MAX_RETRIES = 5
+
+# Opt-in: filter the report server-side with S3 Select instead of downloading it
+USE_S3_SELECT = os.environ.get("USE_S3_SELECT", "false").lower() == "true"
+
+# Let botocore retry throttling and transient errors with exponential backoff,
+# and keep the connection alive while the report body streams in
+S3_CLIENT_CONFIG = Config(
+    retries={"max_attempts": MAX_RETRIES, "mode": "adaptive"},
+    tcp_keepalive=True
+)
+
+# Size of the reads made against the S3 response body
+S3_READ_CHUNK_SIZE = 1024 * 1024
+
+# Query used when USE_S3_SELECT is enabled. Rows without an accountId or
+# controlName are dropped in S3 as well; AWS::::Account rows are not excluded
+# here so they are still counted in the NON_COMPLIANT total
+S3_SELECT_EXPRESSION = (
+    "SELECT s.accountId, s.guardrail, s.controlName, s.resourceType, s.resourceArn "
+    "FROM S3Object s WHERE TRIM(s.compliance) = 'NON_COMPLIANT' "
+    "AND s.accountId <> '' AND s.controlName <> ''"
+)
+
+# Report keys that are read, either plain or gzip-compressed
+CSV_SUFFIXES = (".csv", ".csv.gz")
+
+# Number of reported items returned in the Lambda response
+RESPONSE_SAMPLE_SIZE = 100
+
+# Fields extracted from each NON_COMPLIANT row of the report
+CSV_FIELDS = ("accountId", "guardrail", "controlName", "resourceType", "resourceArn")
+
+# Splits an ARN into its five "arn:partition:service:region:account:" prefix
+# fields and the text after its last colon, used when shortening for display
+_ARN_RE = re.compile(r'((?:[^:]*:){5})(?:.*:)?([^:]*)', re.DOTALL)
+
+# Captures the report date from keys like <account>_<YYYY-MM-DD>.csv[.gz]
+_DATE_RE = re.compile(r'_(\d{4}-\d{2}-\d{2})\.csv(?:\.gz)?$')
+
+# Slack rejects messages with more than 50 blocks; larger reports are split
+# into messages of at most 40 blocks, posted in order over one connection
+SLACK_MAX_BLOCKS = 40
+
+# Emoji used in the Slack message, written as escapes so the source encoding
+# cannot garble them
+EMOJI_ALERT = "\U0001F6A8"  # 🚨
+EMOJI_CHART = "\U0001F4CA"  # 📊
+EMOJI_CALENDAR = "\U0001F4C5"  # 📅
+EMOJI_FOLDER = "\U0001F4C1"  # 📁
+EMOJI_CLOCK = "\u23F0"  # ⏰
+EMOJI_TARGET = "\U0001F3AF"  # 🎯
+EMOJI_WRENCH = "\U0001F527"  # 🔧
+EMOJI_CLIPBOARD = "\U0001F4CB"  # 📋
+EMOJI_PACKAGE = "\U0001F4E6"  # 📦
+EMOJI_BULB = "\U0001F4A1"  # 💡
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-def create_boto3_clients():
-    return {
-        "s3": boto3.client("s3")
-    }
+# Created once per container so warm invocations reuse the S3 client and the
+# pooled HTTPS connection to Slack
+S3_CLIENT = boto3.client("s3", config=S3_CLIENT_CONFIG)
+HTTP = urllib3.PoolManager(
+    num_pools=1,
+    maxsize=1,
+    timeout=urllib3.Timeout(connect=3, read=10),
+    # A webhook POST is not idempotent, so status retries are limited to 429
+    # rate limiting; a 5xx may follow a post that was delivered. Connection
+    # failures are retried, and so is one read error: a keep-alive socket that
+    # went stale while the Lambda was frozen fails the first post after a thaw.
+    # Retry-After is ignored in favour of a short bounded backoff so a long rate
+    # limit cannot use up the Lambda timeout. The last response is returned
+    # rather than raised so its status is logged
+    retries=urllib3.Retry(
+        total=2,
+        read=1,
+        backoff_factor=1,
+        status_forcelist=(429,),
+        allowed_methods=frozenset({"POST"}),
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+)
+SLACK_HEADERS = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
 
 def lambda_handler(event, context):
     logger.info("Starting S3 CSV to Slack Lambda function.")
-    logger.info(f"Lambda timeout: {context.get_remaining_time_in_millis() / 1000:.1f} seconds")
-    
-    clients = create_boto3_clients()
+    logger.info("Lambda timeout: %.1f seconds", context.get_remaining_time_in_millis() / 1000)
     
     try:
-        result = process_s3_csv_to_slack(clients)
+        result = process_s3_csv_to_slack(event)
         logger.info("Lambda finished with status: %s", result.get("status"))
         return result
     except Exception as e:
         logger.error("Unexpected error in lambda_handler: %s", str(e), exc_info=True)
         return {"status": "error", "message": str(e)}
 
-def process_s3_csv_to_slack(clients):
-    # Get the latest CSV file from S3
-    latest_csv_key = get_latest_csv_file(clients["s3"])
+def process_s3_csv_to_slack(event=None, s3_client=S3_CLIENT):
+    if is_s3_event(event):
+        # An S3 notification names the new report, so the bucket is not listed
+        latest_csv_key = get_csv_key_from_event(event)
+        if not latest_csv_key:
+            logger.info("S3 event does not reference a report CSV in %s, nothing to do.", S3_BUCKET)
+            return {"status": "ignored", "message": "S3 event is not for a report CSV"}
+    else:
+        # Scheduled and manual runs pick the latest CSV file from S3
+        latest_csv_key = get_latest_csv_file(s3_client)
     
     if not latest_csv_key:
         logger.info("No CSV files found in S3 bucket.")
         return {"status": "no_files", "message": "No CSV files found"}
     
-    logger.info(f"Processing latest CSV file: {latest_csv_key}")
+    logger.info("Processing latest CSV file: %s", latest_csv_key)
     
-    # Download and parse the CSV file
-    non_compliant_items = parse_csv_for_non_compliant(clients["s3"], latest_csv_key)
+    # Download and parse the CSV file, dropping AWS::::Account rows as they are read
+    sample_items, guardrail_tree, non_compliant_count = parse_csv_for_non_compliant(s3_client, latest_csv_key)
     
     # Send results to Slack if webhook URL is configured
-    if non_compliant_items:
+    if guardrail_tree:
         slack_webhook_url = os.environ.get("SLACK_WEBHOOK_URL")
         if slack_webhook_url:
-            send_to_slack(non_compliant_items, slack_webhook_url, latest_csv_key)
+            send_to_slack(guardrail_tree, slack_webhook_url, latest_csv_key, non_compliant_count)
         else:
             logger.warning("SLACK_WEBHOOK_URL not configured, unable to send notifications")
+    elif non_compliant_count:
+        logger.info("All non-compliant items were AWS::::Account type - no Slack notification needed")
     else:
         logger.info("No NON_COMPLIANT items found in CSV file.")
     
-    logger.info(f"Found {len(non_compliant_items)} NON_COMPLIANT items.")
+    logger.info("Found %s NON_COMPLIANT items.", non_compliant_count)
     
     return {
         "status": "success",
         "csv_file": latest_csv_key,
-        "non_compliant_count": len(non_compliant_items),
-        "non_compliant_items": non_compliant_items[:100]  # Return first 100 items in response
+        "non_compliant_count": non_compliant_count,
+        "non_compliant_items": sample_items  # Return first 100 items in response
     }
 
+def is_s3_event(event):
+    """Return True if the Lambda was invoked by an S3 event notification."""
+    return isinstance(event, dict) and any(
+        record.get("eventSource") == "aws:s3" for record in event.get("Records") or []
+    )
+
+def get_csv_key_from_event(event):
+    """Return the first top-level report key created in the bucket, or None."""
+    for record in event.get("Records") or []:
+        s3_info = record.get("s3", {})
+        if s3_info.get("bucket", {}).get("name") != S3_BUCKET:
+            continue
+        # Keys in event notifications are URL encoded
+        key = unquote_plus(s3_info.get("object", {}).get("key", ""))
+        if "/" not in key and key.endswith(CSV_SUFFIXES):
+            return key
+    return None
+
 def get_latest_csv_file(s3_client):
-    """Get the most recently modified CSV file from the S3 bucket."""
+    """Get the most recently modified CSV file (plain or gzipped) from the S3 bucket."""
     try:
-        # List all objects in the bucket
-        response = safe_aws_call(
-            s3_client.list_objects_v2,
-            "list_objects_v2",
-            Bucket=config["S3_BUCKET"]
+        # The compiled reports are written at the top of the bucket as
+        # <account>_<date>.csv; listing with a delimiter collapses the chunks/
+        # and state/ working prefixes so only top-level keys are returned.
+        # A single call stops at 1000 keys, so every page is walked
+        paginator = s3_client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=S3_BUCKET,
+            Delimiter="/",
+            PaginationConfig={'PageSize': 1000}
         )
         
-        if 'Contents' not in response:
-            return None
-        
-        # Filter for CSV files and find the latest one
-        csv_files = [
-            obj for obj in response['Contents'] 
-            if obj['Key'].endswith('.csv')
-        ]
+        # Track the latest CSV file across pages without building a list
+        latest_file = max(
+            (
+                obj
+                for page in pages
+                for obj in page.get('Contents', [])
+                if obj['Key'].endswith(CSV_SUFFIXES)
+            ),
+            key=lambda x: (x['LastModified'], x['Key']),
+            default=None
+        )
         
-        if not csv_files:
+        if not latest_file:
             return None
         
-        # Sort by LastModified date (most recent first)
-        latest_file = max(csv_files, key=lambda x: x['LastModified'])
-        
-        logger.info(f"Found latest CSV file: {latest_file['Key']} (modified: {latest_file['LastModified']})")
+        logger.info("Found latest CSV file: %s (modified: %s)", latest_file['Key'], latest_file['LastModified'])
         return latest_file['Key']
         
     except Exception as e:
-        logger.error(f"Error getting latest CSV file: {str(e)}")
+        logger.error("Error getting latest CSV file: %s", str(e))
         raise
 
-def parse_csv_for_non_compliant(s3_client, csv_key):
-    """Download CSV file from S3 and extract NON_COMPLIANT items."""
-    try:
-        # Download the CSV file
-        response = safe_aws_call(
-            s3_client.get_object,
-            "get_object",
-            Bucket=config["S3_BUCKET"],
-            Key=csv_key
-        )
+class _ChunkStream(io.RawIOBase):
+    """Read-only raw stream over an iterator of bytes chunks.
+    
+    Lets the gzip and text layers read the S3 body in whatever sizes they
+    like while the socket is read S3_READ_CHUNK_SIZE bytes at a time.
+    """
+    
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = memoryview(b"")
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+def _stream_non_compliant_rows(s3_client, csv_key):
+    """Download the CSV file from S3 and yield its NON_COMPLIANT rows as dicts."""
+    response = s3_client.get_object(
+        Bucket=S3_BUCKET,
+        Key=csv_key
+    )
+    
+    # Pull the body from the socket in large reads rather than the 8 KiB
+    # requests the gzip and text layers make
+    body = io.BufferedReader(_ChunkStream(response['Body'].iter_chunks(S3_READ_CHUNK_SIZE)))
+    
+    # Compressed reports are decompressed as they stream in
+    if response.get('ContentEncoding') == 'gzip' or csv_key.endswith('.gz'):
+        body = gzip.GzipFile(fileobj=body)
+    
+    # Stream the CSV content so rows are parsed as the body downloads,
+    # rather than holding the whole file in memory as bytes and str
+    text_stream = io.TextIOWrapper(body, encoding='utf-8', newline='')
+    # The report is written by csv.writer, so fields carry no padding; any
+    # leading space is dropped by the reader rather than stripped per field
+    csv_reader = csv.reader(text_stream, skipinitialspace=True)
+    
+    # Resolve the column positions once from the header row instead of
+    # building a dict for every row
+    header = next(csv_reader, [])
+    column_index = {name: index for index, name in enumerate(header)}
+    if 'compliance' not in column_index:
+        logger.warning("CSV file %s has no compliance column", csv_key)
+        return
+    compliance_index = column_index['compliance']
+    field_indices = [(field, column_index.get(field)) for field in CSV_FIELDS]
+    
+    # When the header has every field, complete rows are read with a single
+    # itemgetter call; short rows and missing columns take the slower path
+    get_fields = None
+    min_width = 0
+    if all(index is not None for _, index in field_indices):
+        indices = [index for _, index in field_indices]
+        get_fields = operator.itemgetter(*indices)
+        min_width = max(indices) + 1
+    
+    for row in csv_reader:
+        # Check if compliance status is NON_COMPLIANT
+        if len(row) <= compliance_index or row[compliance_index] != 'NON_COMPLIANT':
+            continue
         
-        # Read the CSV content
-        csv_content = response['Body'].read().decode('utf-8')
-        csv_reader = csv.DictReader(StringIO(csv_content))
+        # Extract required fields
+        if get_fields is not None and len(row) >= min_width:
+            yield dict(zip(CSV_FIELDS, get_fields(row)))
+        else:
+            yield {
+                field: row[index] if index is not None and index < len(row) else ''
+                for field, index in field_indices
+            }
+
+def _select_non_compliant_rows(s3_client, csv_key):
+    """Filter the CSV file with S3 Select and return its NON_COMPLIANT rows as dicts.
+    
+    Only matching rows are sent back by S3. They are collected before returning
+    so that a failure part way through the event stream can still fall back to
+    a full download.
+    """
+    response = s3_client.select_object_content(
+        Bucket=S3_BUCKET,
+        Key=csv_key,
+        ExpressionType='SQL',
+        Expression=S3_SELECT_EXPRESSION,
+        InputSerialization={
+            'CSV': {'FileHeaderInfo': 'USE'},
+            'CompressionType': 'GZIP' if csv_key.endswith('.gz') else 'NONE'
+        },
+        OutputSerialization={'JSON': {'RecordDelimiter': '\n'}}
+    )
+    
+    records = []
+    pending = b''
+    for event in response['Payload']:
+        if 'Records' in event:
+            # A record can be split across events, so only complete lines are parsed
+            lines = (pending + event['Records']['Payload']).split(b'\n')
+            pending = lines.pop()
+            records.extend(json.loads(line) for line in lines if line)
+        elif 'End' in event:
+            break
+    else:
+        raise RuntimeError(f"S3 Select stream for {csv_key} ended before the End event")
+    if pending.strip():
+        records.append(json.loads(pending))
+    
+    return [
+        {field: str(record.get(field, '')).strip() for field in CSV_FIELDS}
+        for record in records
+    ]
+
+def _new_guardrail_tree():
+    """Return an empty tree of guardrail -> control -> aggregated findings.
+    
+    Each control holds its affected account IDs and, per resource type, the
+    item count and the ARNs of the first three items.
+    """
+    return defaultdict(lambda: defaultdict(lambda: {
+        "accounts": set(),
+        "resource_types": defaultdict(lambda: {"count": 0, "arns": []})
+    }))
+
+def _add_to_guardrail_tree(guardrail_tree, item):
+    """Fold one NON_COMPLIANT item into the guardrail tree."""
+    control = guardrail_tree[item.get('guardrail', 'Unknown')][item.get('controlName', 'Unknown')]
+    if item.get('accountId'):
+        control["accounts"].add(item['accountId'])
+    resource_type = control["resource_types"][item.get('resourceType', 'Unknown')]
+    resource_type["count"] += 1
+    if len(resource_type["arns"]) < 3:
+        resource_type["arns"].append(item.get('resourceArn', ''))
+
+def parse_csv_for_non_compliant(s3_client, csv_key, include_account_items=False):
+    """Download CSV file from S3 and aggregate its NON_COMPLIANT items.
+    
+    Returns a tuple of (sample_items, guardrail_tree, total_count): the first
+    RESPONSE_SAMPLE_SIZE items to report, the tree built by _add_to_guardrail_tree
+    from every item to report, and the total NON_COMPLIANT count. AWS::::Account
+    items are counted but not reported unless include_account_items is set.
+    """
+    try:
+        rows = None
+        if USE_S3_SELECT:
+            try:
+                rows = _select_non_compliant_rows(s3_client, csv_key)
+            except Exception as e:
+                logger.warning("S3 Select failed for %s, downloading the whole file instead: %s", csv_key, str(e))
+        if rows is None:
+            rows = _stream_non_compliant_rows(s3_client, csv_key)
         
-        non_compliant_items = []
+        # Rows are folded into the tree as they are read, so only a bounded
+        # sample of raw items is held for the response
+        non_compliant_count = 0
+        reported_count = 0
+        sample_items = []
+        guardrail_tree = _new_guardrail_tree()
         
-        for row in csv_reader:
-            # Check if compliance status is NON_COMPLIANT
-            compliance = row.get('compliance', '').strip()
-            if compliance == 'NON_COMPLIANT':
-                # Extract required fields
-                non_compliant_item = {
-                    "accountId": row.get('accountId', '').strip(),
-                    "guardrail": row.get('guardrail', '').strip(),
-                    "controlName": row.get('controlName', '').strip(),
-                    "resourceType": row.get('resourceType', '').strip(),
-                    "resourceArn": row.get('resourceArn', '').strip()
-                }
-                
-                # Only add if we have at least accountId and controlName
-                if non_compliant_item["accountId"] and non_compliant_item["controlName"]:
-                    non_compliant_items.append(non_compliant_item)
-                    logger.info(f"Found NON_COMPLIANT item: Account {non_compliant_item['accountId']}, Control {non_compliant_item['controlName']}")
+        for non_compliant_item in rows:
+            # Only add if we have at least accountId and controlName
+            if not (non_compliant_item["accountId"] and non_compliant_item["controlName"]):
+                continue
+            
+            non_compliant_count += 1
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Found NON_COMPLIANT item: Account %s, Control %s",
+                    non_compliant_item['accountId'],
+                    non_compliant_item['controlName']
+                )
+            
+            # Account-level findings are left out of the Slack notification
+            if not include_account_items and non_compliant_item["resourceType"] == 'AWS::::Account':
+                continue
+            
+            reported_count += 1
+            _add_to_guardrail_tree(guardrail_tree, non_compliant_item)
+            if len(sample_items) < RESPONSE_SAMPLE_SIZE:
+                sample_items.append(non_compliant_item)
         
-        logger.info(f"Parsed {len(non_compliant_items)} NON_COMPLIANT items from CSV")
-        return non_compliant_items
+        logger.info("Parsed %s NON_COMPLIANT items from CSV, %s kept for reporting", non_compliant_count, reported_count)
+        return sample_items, guardrail_tree, non_compliant_count
         
     except Exception as e:
-        logger.error(f"Error parsing CSV file {csv_key}: {str(e)}")
+        logger.error("Error parsing CSV file %s: %s", csv_key, str(e))
         raise
 
-def safe_aws_call(fn, context_msg, *args, **kwargs):
-    """Safely call AWS API with retries."""
-    delay = 1
-    for attempt in range(1, config["MAX_RETRIES"] + 1):
-        try:
-            return fn(*args, **kwargs)
-        except ClientError as e:
-            error_code = e.response.get('Error', {}).get('Code', '')
-            if error_code == 'AccessDeniedException':
-                logger.error(
-                    "Access denied for %s: %s. Please ensure the Lambda execution role has S3 read permissions.",
-                    context_msg,
-                    str(e)
-                )
-                raise  # Don't retry permission errors
+def _shorten_arn(arn):
+    """Truncate long ARNs for display, keeping the prefix and the tail of the resource."""
+    if len(arn) <= 60:
+        return arn
+    
+    match = _ARN_RE.match(arn)
+    if not match:
+        return arn[:57] + "..."
+    
+    # Keep the resource identifier part
+    return f"{match.group(1)}...{match.group(2)[-20:]}"
+
+def _render_guardrail_blocks(guardrail, controls, add_separator):
+    """Yield the Slack blocks describing one guardrail's affected controls.
+    
+    controls is the guardrail's branch of the tree from _new_guardrail_tree.
+    """
+    # Create section for this guardrail's controls, collecting the lines in a
+    # list and joining once instead of growing a string
+    parts = [f"*{EMOJI_WRENCH} {guardrail} - Affected Controls:*\n"]
+    for control_name, control in controls.items():
+        resource_types = control["resource_types"]
+        # Sort the unique account IDs for consistent display
+        affected_accounts = sorted(control["accounts"])
+        control_item_count = sum(type_info["count"] for type_info in resource_types.values())
+        
+        # Format the accounts list
+        if len(affected_accounts) <= 5:
+            accounts_display = ", ".join(f"`{acc}`" for acc in affected_accounts)
+        else:
+            # Show first 4 accounts and indicate how many more
+            first_accounts = ", ".join(f"`{acc}`" for acc in affected_accounts[:4])
+            remaining_count = len(affected_accounts) - 4
+            accounts_display = f"{first_accounts}, +{remaining_count} more"
+        
+        parts.append(f"• `{control_name}` ({control_item_count} items)\n")
+        parts.append(f"  {EMOJI_CLIPBOARD} Accounts: {accounts_display}\n")
+        
+        # Add resource type and ARN information
+        for resource_type, type_info in resource_types.items():
+            type_count = type_info["count"]
+            parts.append(f"  {EMOJI_PACKAGE} Type: `{resource_type}` ({type_count} items)\n")
             
-            logger.warning(
-                "[Attempt %s/%s] AWS call failed (%s): %s",
-                attempt,
-                config["MAX_RETRIES"],
-                context_msg,
-                str(e)
-            )
-            if attempt == config["MAX_RETRIES"]:
-                logger.error("Max retries reached for %s. Raising exception.", context_msg)
-                raise
+            # Show up to 3 ARNs for this resource type
+            arns_to_show = [_shorten_arn(arn) for arn in type_info["arns"] if arn]
             
-        except BotoCoreError as e:
-            logger.warning(
-                "[Attempt %s/%s] AWS call failed (%s): %s",
-                attempt,
-                config["MAX_RETRIES"],
-                context_msg,
-                str(e)
-            )
-            if attempt == config["MAX_RETRIES"]:
-                logger.error("Max retries reached for %s. Raising exception.", context_msg)
-                raise
+            if arns_to_show:
+                parts.extend(f"    • `{arn}`\n" for arn in arns_to_show)
+                
+                # Indicate if there are more ARNs
+                if type_count > 3:
+                    remaining_arns = type_count - 3
+                    parts.append(f"    • ...and {remaining_arns} more resources\n")
+            else:
+                parts.append("    • No ARN information available\n")
+        
+        parts.append("\n")  # Add spacing between controls
+    controls_text = "".join(parts)
+    
+    yield {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": controls_text
+        }
+    }
+    
+    # Add a divider between guardrails (except for the last one)
+    if add_separator:
+        yield {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "mrkdwn",
+                    "text": "─" * 50
+                }
+            ]
+        }
 
-def send_to_slack(non_compliant_items, webhook_url, csv_file):
-    """Send non-compliant items to Slack."""
+def _paginate_message(message):
+    """Split a Slack message into messages that each fit within SLACK_MAX_BLOCKS.
+    
+    A message that already fits is returned unchanged. Otherwise every part
+    ends with a context block labelling it "Part i of n".
+    """
+    blocks = message["blocks"]
+    if len(blocks) <= SLACK_MAX_BLOCKS:
+        return [message]
+    
+    # Leave room on each page for the part label
+    page_size = SLACK_MAX_BLOCKS - 1
+    pages = [blocks[start:start + page_size] for start in range(0, len(blocks), page_size)]
+    return [
+        {
+            "text": f"{message['text']} (part {number} of {len(pages)})",
+            "blocks": page + [{
+                "type": "context",
+                "elements": [
+                    {
+                        "type": "mrkdwn",
+                        "text": f"Part {number} of {len(pages)}"
+                    }
+                ]
+            }]
+        }
+        for number, page in enumerate(pages, 1)
+    ]
+
+def _post_to_slack(webhook_url, message):
+    """POST one message to the Slack webhook and return whether Slack accepted it."""
+    # Send over the pooled connection for the webhook host. Slack only
+    # replies "ok", so the body is read only when the post fails
+    slack_pool = HTTP.connection_from_url(webhook_url)
+    response = slack_pool.urlopen(
+        'POST',
+        urllib3.util.parse_url(webhook_url).request_uri,
+        # Compact separators and raw UTF-8 keep the emoji-heavy payload small
+        body=json.dumps(message, separators=(',', ':'), ensure_ascii=False).encode('utf-8'),
+        headers=SLACK_HEADERS,
+        preload_content=False
+    )
+    
+    try:
+        if response.status == 200:
+            return True
+        logger.error("Failed to send to Slack. Status: %s, Response: %s", response.status, response.read())
+        return False
+    finally:
+        # Return the connection to the pool so the next post can reuse it
+        response.drain_conn()
+        response.release_conn()
+
+def send_to_slack(guardrail_tree, webhook_url, csv_file, total_count=None):
+    """Send non-compliant items to Slack.
+    
+    guardrail_tree is the aggregate from parse_csv_for_non_compliant, which
+    already excludes AWS::::Account items; total_count is the NON_COMPLIANT
+    total before that filter, used for logging.
+    """
     try:
-        # Filter out AWS::::Account resource types for Slack display
-        filtered_items = [
-            item for item in non_compliant_items 
-            if item.get('resourceType', '').strip() != 'AWS::::Account'
+        # One ordered (guardrail, controls, issue count) view serves both the
+        # summary and the per-guardrail blocks
+        ordered = [
+            (guardrail, controls, sum(
+                type_info["count"]
+                for control in controls.values()
+                for type_info in control["resource_types"].values()
+            ))
+            for guardrail, controls in guardrail_tree.items()
         ]
+        reported_count = sum(count for _, _, count in ordered)
+        if total_count is None:
+            total_count = reported_count
         
-        logger.info(f"Filtered {len(non_compliant_items) - len(filtered_items)} AWS::::Account items from Slack notification")
+        logger.info("Filtered %s AWS::::Account items from Slack notification", total_count - reported_count)
         
-        if not filtered_items:
+        if not reported_count:
             logger.info("All non-compliant items were AWS::::Account type - no Slack notification needed")
             return
         
-        # Extract date from filename for better context
-        file_date = "Unknown"
-        if "_" in csv_file:
-            try:
-                date_part = csv_file.split("_")[-1].replace(".csv", "")
-                file_date = date_part
-            except:
-                pass
+        # The alert time is labelled UTC, so take it from a UTC clock
+        alert_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        
+        # Extract date from filename (<account>_<date>.csv) for better context
+        date_match = _DATE_RE.search(csv_file)
+        file_date = date_match.group(1) if date_match else "Unknown"
         
         # Prepare Slack message with better formatting
         message = {
-            "text": f"🚨 AWS Guardrails Compliance Report - {len(filtered_items)} Non-Compliant Items Found",
+            "text": f"{EMOJI_ALERT} AWS Guardrails Compliance Report - {reported_count} Non-Compliant Items Found",
             "blocks": [
                 {
                     "type": "header",
                     "text": {
                         "type": "plain_text",
-                        "text": f"🚨 AWS Guardrails Compliance Report"
+                        "text": f"{EMOJI_ALERT} AWS Guardrails Compliance Report"
                     }
                 },
                 {
@@ -227,19 +592,19 @@ def send_to_slack(non_compliant_items, webhook_url, csv_file):
                     "fields": [
                         {
                             "type": "mrkdwn",
-                            "text": f"*📊 Total Issues:*\n{len(filtered_items)} non-compliant items"
+                            "text": f"*{EMOJI_CHART} Total Issues:*\n{reported_count} non-compliant items"
                         },
                         {
                             "type": "mrkdwn",
-                            "text": f"*📅 Report Date:*\n{file_date}"
+                            "text": f"*{EMOJI_CALENDAR} Report Date:*\n{file_date}"
                         },
                         {
                             "type": "mrkdwn",
-                            "text": f"*📁 Source File:*\n`{csv_file}`"
+                            "text": f"*{EMOJI_FOLDER} Source File:*\n`{csv_file}`"
                         },
                         {
                             "type": "mrkdwn",
-                            "text": f"*⏰ Alert Time:*\n{datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}"
+                            "text": f"*{EMOJI_CLOCK} Alert Time:*\n{alert_time}"
                         }
                     ]
                 },
@@ -249,21 +614,16 @@ def send_to_slack(non_compliant_items, webhook_url, csv_file):
             ]
         }
         
-        # Group items by guardrail for better organization
-        guardrail_groups = {}
-        for item in filtered_items:
-            guardrail = item.get('guardrail', 'Unknown')
-            if guardrail not in guardrail_groups:
-                guardrail_groups[guardrail] = []
-            guardrail_groups[guardrail].append(item)
-        
         # Add summary of guardrails and their affected controls
-        if guardrail_groups:
-            guardrails_text = f"*🎯 Affected Guardrails ({len(guardrail_groups)}):*\n"
-            for guardrail, items in list(guardrail_groups.items())[:5]:  # Show up to 5 guardrails
-                guardrails_text += f"• `{guardrail}` ({len(items)} issues)\n"
-            if len(guardrail_groups) > 5:
-                guardrails_text += f"• ...and {len(guardrail_groups) - 5} more guardrails\n"
+        if ordered:
+            summary_parts = [f"*{EMOJI_TARGET} Affected Guardrails ({len(ordered)}):*\n"]
+            summary_parts.extend(
+                f"• `{guardrail}` ({count} issues)\n"
+                for guardrail, _, count in ordered[:5]  # Show up to 5 guardrails
+            )
+            if len(ordered) > 5:
+                summary_parts.append(f"• ...and {len(ordered) - 5} more guardrails\n")
+            guardrails_text = "".join(summary_parts)
             
             message["blocks"].append({
                 "type": "section",
@@ -278,95 +638,11 @@ def send_to_slack(non_compliant_items, webhook_url, csv_file):
             })
             
             # Add affected controls grouped by guardrail
-            for guardrail, items in guardrail_groups.items():
-                # Group items by control within this guardrail
-                control_groups = {}
-                for item in items:
-                    control_name = item.get('controlName', 'Unknown')
-                    if control_name not in control_groups:
-                        control_groups[control_name] = []
-                    control_groups[control_name].append(item)
-                
-                # Create section for this guardrail's controls
-                controls_text = f"*🔧 {guardrail} - Affected Controls:*\n"
-                for control_name, control_items in control_groups.items():
-                    # Get unique account IDs for this control
-                    affected_accounts = list(set(item.get('accountId', '') for item in control_items if item.get('accountId')))
-                    affected_accounts.sort()  # Sort for consistent display
-                    
-                    # Format the accounts list
-                    if len(affected_accounts) <= 5:
-                        accounts_display = ", ".join(f"`{acc}`" for acc in affected_accounts)
-                    else:
-                        # Show first 4 accounts and indicate how many more
-                        first_accounts = ", ".join(f"`{acc}`" for acc in affected_accounts[:4])
-                        remaining_count = len(affected_accounts) - 4
-                        accounts_display = f"{first_accounts}, +{remaining_count} more"
-                    
-                    controls_text += f"• `{control_name}` ({len(control_items)} items)\n"
-                    controls_text += f"  📋 Accounts: {accounts_display}\n"
-                    
-                    # Group resources by type for better organization
-                    resource_types = {}
-                    for item in control_items:
-                        resource_type = item.get('resourceType', 'Unknown').strip()
-                        if resource_type not in resource_types:
-                            resource_types[resource_type] = []
-                        resource_types[resource_type].append(item)
-                    
-                    # Add resource type and ARN information
-                    for resource_type, type_items in resource_types.items():
-                        controls_text += f"  📦 Type: `{resource_type}` ({len(type_items)} items)\n"
-                        
-                        # Show up to 3 ARNs for this resource type
-                        arns_to_show = []
-                        for item in type_items[:3]:
-                            arn = item.get('resourceArn', '').strip()
-                            if arn:
-                                # Smart ARN truncation for display
-                                if len(arn) > 60:
-                                    parts = arn.split(':')
-                                    if len(parts) >= 6:
-                                        # Keep the resource identifier part
-                                        truncated = f"{parts[0]}:{parts[1]}:{parts[2]}:{parts[3]}:{parts[4]}:...{parts[-1][-20:]}"
-                                    else:
-                                        truncated = arn[:57] + "..."
-                                    arns_to_show.append(truncated)
-                                else:
-                                    arns_to_show.append(arn)
-                        
-                        if arns_to_show:
-                            for i, arn in enumerate(arns_to_show):
-                                controls_text += f"    • `{arn}`\n"
-                            
-                            # Indicate if there are more ARNs
-                            if len(type_items) > 3:
-                                remaining_arns = len(type_items) - 3
-                                controls_text += f"    • ...and {remaining_arns} more resources\n"
-                        else:
-                            controls_text += f"    • No ARN information available\n"
-                    
-                    controls_text += "\n"  # Add spacing between controls
-                
-                message["blocks"].append({
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": controls_text
-                    }
-                })
-                
-                # Add a divider between guardrails (except for the last one)
-                if guardrail != list(guardrail_groups.keys())[-1]:
-                    message["blocks"].append({
-                        "type": "context",
-                        "elements": [
-                            {
-                                "type": "mrkdwn",
-                                "text": "─" * 50
-                            }
-                        ]
-                    })
+            last_index = len(ordered) - 1
+            message["blocks"].extend(chain.from_iterable(
+                _render_guardrail_blocks(guardrail, controls, index < last_index)
+                for index, (guardrail, controls, _) in enumerate(ordered)
+            ))
         
         # Add footer with action suggestion
         message["blocks"].extend([
@@ -378,26 +654,28 @@ def send_to_slack(non_compliant_items, webhook_url, csv_file):
                 "elements": [
                     {
                         "type": "mrkdwn",
-                        "text": "💡 *Next Steps:* Review the non-compliant resources and take corrective action according to your organization's policies."
+                        "text": f"{EMOJI_BULB} *Next Steps:* Review the non-compliant resources and take corrective action according to your organization's policies."
                     }
                 ]
             }
         ])
         
-        # Send to Slack
-        http = urllib3.PoolManager()
-        response = http.request(
-            'POST',
-            webhook_url,
-            body=json.dumps(message),
-            headers={'Content-Type': 'application/json'}
-        )
+        # Send to Slack, split into several messages when over the block limit.
+        # Parts are posted one after another so they arrive in order, each
+        # reusing the kept-alive connection
+        messages = _paginate_message(message)
+        results = [_post_to_slack(webhook_url, page) for page in messages]
         
-        if response.status == 200:
-            logger.info(f"Successfully sent {len(filtered_items)} non-compliant items to Slack (filtered from {len(non_compliant_items)} total)")
+        if all(results):
+            logger.info(
+                "Successfully sent %s non-compliant items to Slack in %s message(s) (filtered from %s total)",
+                reported_count,
+                len(messages),
+                total_count
+            )
         else:
-            logger.error(f"Failed to send to Slack. Status: {response.status}, Response: {response.data}")
+            logger.error("Failed to send %s of %s Slack message(s)", results.count(False), len(messages))
             
     except Exception as e:
-        logger.error(f"Failed to send notification to Slack: {str(e)}")
+        logger.error("Failed to send notification to Slack: %s", str(e))
         # Don't raise the exception to avoid failing the entire function